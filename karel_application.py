@@ -12,12 +12,11 @@ from __future__ import annotations
 
 import importlib.util
 import inspect
+import operator
 import pygame as pg
 import traceback as tb
 from pathlib import Path
-from time import sleep
-from tkinter.filedialog import askopenfilename
-from tkinter.messagebox import showwarning
+from time import monotonic
 from types import FrameType, ModuleType
 from typing import Any, Callable, cast
 
@@ -25,6 +24,53 @@ from .didyoumean import add_did_you_mean
 from .karel_world import Direction
 from .karel_program import KarelException, KarelProgram
 
+# Directory containing this package, resolved once at import time
+_MODULE_DIR = Path(__file__).resolve().parent
+
+# Wall-clock seconds a student program may run, not counting the delays
+# between actions, so the limit does not depend on the world's speed
+STUDENT_TIMEOUT = 30
+
+# Karel functions in student code that are re-bound to the running Karel
+FUNCTIONS_TO_OVERRIDE: tuple[str, ...] = (
+    "move",
+    "turn_left",
+    "pick_beeper",
+    "put_beeper",
+    "facing_north",
+    "facing_south",
+    "facing_east",
+    "facing_west",
+    "not_facing_north",
+    "not_facing_south",
+    "not_facing_east",
+    "not_facing_west",
+    "front_is_clear",
+    "beepers_present",
+    "no_beepers_present",
+    "beepers_in_bag",
+    "no_beepers_in_bag",
+    "front_is_blocked",
+    "left_is_blocked",
+    "left_is_clear",
+    "right_is_blocked",
+    "right_is_clear",
+    "paint_corner",
+    "corner_color_is",
+)
+get_karel_functions = operator.attrgetter(*FUNCTIONS_TO_OVERRIDE)
+
+# This map associates wall directions with the endpoints of the line
+# drawn for that wall, relative to the top-left pixel of its corner
+WALL_SEGMENT_MAP: dict[
+    Direction, Callable[[int, int], tuple[tuple[int, int], tuple[int, int]]]
+] = {
+    Direction.NORTH: lambda x, y: ((x, y), (x + 40, y)),
+    Direction.SOUTH: lambda x, y: ((x, y + 40), (x + 40, y + 40)),
+    Direction.EAST: lambda x, y: ((x + 40, y), (x + 40, y + 40)),
+    Direction.WEST: lambda x, y: ((x, y), (x, y + 40)),
+}
+
 
 class StudentModule(ModuleType):
     move: Any
@@ -49,6 +95,8 @@ class StudentCode:
             raise FileNotFoundError(f"{code_file} could not be found.")
 
         self.module_name = code_file.stem
+        # Source text for __repr__, read lazily on first use
+        self._source_cache: str | None = None
         spec = importlib.util.spec_from_file_location(
             self.module_name, code_file.resolve()
         )
@@ -60,18 +108,14 @@ class StudentCode:
             self.mods: list[StudentModule] = [mod]
             module_loader.exec_module(mod)
             # Go through attributes to find imported modules
-            for name in dir(mod):
-                module = cast(StudentModule, getattr(mod, name))
-                if isinstance(module, ModuleType):
+            for name, module in list(vars(mod).items()):
+                if not name.startswith("_") and isinstance(module, ModuleType):
                     assert module.__file__ is not None
                     code_file_path = Path(module.__file__)
-                    # Only execute modules outside of this directory
-                    if code_file_path.parent != Path(__file__).resolve().parent:
-                        self.mods.append(module)
-                        spec = importlib.util.spec_from_file_location(
-                            name, code_file_path.resolve()
-                        )
-                        module_loader.exec_module(module)
+                    # Only collect modules outside of this directory. They were
+                    # already executed by the student's own import statement.
+                    if code_file_path.parent != _MODULE_DIR:
+                        self.mods.append(cast(StudentModule, module))
         except SyntaxError as e:
             # Since we don't start the GUI until after we parse the student's code,
             # SyntaxErrors behave normally. However, if the syntax error is somehow
@@ -86,7 +130,11 @@ class StudentCode:
             )
 
     def __repr__(self) -> str:
-        return "\n".join([inspect.getsource(mod) for mod in self.mods])
+        if self._source_cache is None:
+            self._source_cache = "\n".join(
+                [inspect.getsource(mod) for mod in self.mods]
+            )
+        return self._source_cache
 
     def inject_namespace(self, karel: KarelProgram) -> None:
         """
@@ -95,35 +143,10 @@ class StudentCode:
         file with specific commands relating to the Karel object that exists
         in the world.
         """
-        functions_to_override = [
-            "move",
-            "turn_left",
-            "pick_beeper",
-            "put_beeper",
-            "facing_north",
-            "facing_south",
-            "facing_east",
-            "facing_west",
-            "not_facing_north",
-            "not_facing_south",
-            "not_facing_east",
-            "not_facing_west",
-            "front_is_clear",
-            "beepers_present",
-            "no_beepers_present",
-            "beepers_in_bag",
-            "no_beepers_in_bag",
-            "front_is_blocked",
-            "left_is_blocked",
-            "left_is_clear",
-            "right_is_blocked",
-            "right_is_clear",
-            "paint_corner",
-            "corner_color_is",
-        ]
+        bound = dict(zip(FUNCTIONS_TO_OVERRIDE, get_karel_functions(karel)))
         for mod in self.mods:
-            for func in functions_to_override:
-                setattr(mod, func, getattr(karel, func))
+            for name, fn in bound.items():
+                setattr(mod, name, fn)
 
     def main(self) -> None:
         try:
@@ -146,10 +169,13 @@ class StudentCode:
             if Path(frame_info.filename).name == f"{self.module_name}.py":
                 display_frames.append((frame, lineno))
 
-        display_frames_generator = (frame for frame in display_frames)
-        trace = tb.format_list(tb.StackSummary.extract(display_frames_generator))
+        trace = tb.format_list(
+            tb.StackSummary.extract(display_frames, capture_locals=False)
+        )
         clean_traceback = "".join(trace).strip()
-        add_did_you_mean(e)
+        # Only NameErrors can carry a useful "did you mean" suggestion
+        if isinstance(e, NameError):
+            add_did_you_mean(e)
         print(
             f"Traceback (most recent call last):\n{clean_traceback}\n"
             f"{type(e).__name__}: {e}"
@@ -172,115 +198,198 @@ class KarelApplication():
             pg.quit()
             return
         self.speed = self.world.init_speed
+        self._deadline: float | None = None
 
         pg.display.set_caption(self.student_code.module_name)
-        pg.display.set_icon(pg.image.load(Path(__file__).absolute().parent / "icon.png"));
-        self.screen = pg.display.set_mode((window_width, window_height))
-        self.themes = Path(__file__).absolute().parent / "themes/default"
-        self.bg = pg.image.load(self.themes / "background.png")
-        self.tree = pg.image.load(self.themes / "tree.png")
-        self.gem = pg.image.load(self.themes / "gem.png")
+        pg.display.set_icon(pg.image.load(_MODULE_DIR / "icon.png"));
+        self.screen = pg.display.set_mode((window_width, window_height), pg.DOUBLEBUF)
+        self.themes = _MODULE_DIR / "themes/default"
+        # convert to the display format once so blits need no per-pixel conversion
+        self.bg = pg.image.load(self.themes / "background.png").convert()
+        self.tree = pg.image.load(self.themes / "tree.png").convert_alpha()
+        self.gem = pg.image.load(self.themes / "gem.png").convert_alpha()
         self.hero = {
-            Direction.EAST: pg.image.load(self.themes / "right.png"),
-            Direction.SOUTH: pg.image.load(self.themes / "down.png"),
-            Direction.WEST: pg.image.load(self.themes / "left.png"),
-            Direction.NORTH: pg.image.load(self.themes / "up.png")
+            Direction.EAST: pg.image.load(self.themes / "right.png").convert_alpha(),
+            Direction.SOUTH: pg.image.load(self.themes / "down.png").convert_alpha(),
+            Direction.WEST: pg.image.load(self.themes / "left.png").convert_alpha(),
+            Direction.NORTH: pg.image.load(self.themes / "up.png").convert_alpha()
         }
+        self.static_bg = pg.Surface((window_width, window_height)).convert()
+        self.update_layout()
+        self.update_beeper_corners()
+        self.redraw_static()
         self.redraw_all()
 
     def mainloop(self) -> None:
         while True:
+            # block until something happens instead of polling the queue
+            event = pg.event.wait(timeout=100)
+            if event.type == pg.NOEVENT:
+                continue
+            self.handle_event(event)
             for event in pg.event.get():
-                if event.type == pg.QUIT:
-                    exit()
-                if event.type == pg.KEYDOWN:
-                    if event.key == pg.K_SPACE:
-                        self.reset_world()
-                        self.run_program()
-                    if event.key == pg.K_ESCAPE:
-                        self.load_world()
-            pg.display.update()
+                self.handle_event(event)
 
-    def redraw_all(self) -> None:
+    def handle_event(self, event: pg.event.Event) -> None:
+        if event.type == pg.QUIT:
+            exit()
+        if event.type == pg.VIDEOEXPOSE:
+            # the window was uncovered, so present the current frame again
+            pg.display.update()
+        if event.type == pg.KEYDOWN:
+            if event.key == pg.K_SPACE:
+                self.reset_world()
+                self.run_program()
+            if event.key == pg.K_ESCAPE:
+                self.load_world()
+
+    def redraw_static(self) -> None:
+        """Render everything that does not change while a program runs."""
         # background
-        self.screen.blit(self.bg, (0, 0))
+        self.static_bg.blit(self.bg, (0, 0))
         # bounding
-        x_offset = (20 - self.world.num_avenues) // 2
-        y_offset = (15 - self.world.num_streets) // 2
-        for x in range(20):
-            for y in range(15):
-                if x < x_offset or x >= x_offset + self.world.num_avenues or \
-                   y < y_offset or y >= y_offset + self.world.num_streets:
-                    self.screen.blit(self.tree, (x * 40, y * 40))
+        self.static_bg.blits([
+            (self.tree, (x * 40, y * 40))
+            for x in range(20) for y in range(15)
+            if x < self._x_off or x >= self._x_off + self.world.num_avenues or
+               y < self._y_off or y >= self._y_off + self.world.num_streets
+        ], doreturn=False)
         # walls
-        for wall in self.world.walls:
-            corner_x = (wall.avenue - 1 + x_offset) * 40
-            corner_y = (self.world.num_streets - wall.street + y_offset) * 40
-            if wall.direction == Direction.NORTH:
-                pg.draw.line(self.screen, (63, 63, 63), \
-                    (corner_x, corner_y), (corner_x + 40, corner_y), width = 5)
-            if wall.direction == Direction.SOUTH:
-                pg.draw.line(self.screen, (63, 63, 63), \
-                    (corner_x, corner_y + 40), (corner_x + 40, corner_y + 40), width = 5)
-            if wall.direction == Direction.EAST:
-                pg.draw.line(self.screen, (63, 63, 63), \
-                    (corner_x + 40, corner_y), (corner_x + 40, corner_y + 40), width = 5)
-            if wall.direction == Direction.WEST:
-                pg.draw.line(self.screen, (63, 63, 63), \
-                    (corner_x, corner_y), (corner_x, corner_y + 40), width = 5)
+        for start, end in self._wall_segments:
+            pg.draw.line(self.static_bg, (63, 63, 63), start, end, width = 5)
+
+    def update_layout(self) -> None:
+        """Recompute the pixel positions that depend on the world's dimensions."""
+        self._x_off = (20 - self.world.num_avenues) // 2
+        self._y_off = (15 - self.world.num_streets) // 2
+        # top-left pixel of every avenue column and street row, indexed by number
+        self._ave_px = [
+            (a - 1 + self._x_off) * 40 for a in range(self.world.num_avenues + 2)
+        ]
+        self._st_px = [
+            (self.world.num_streets - s + self._y_off) * 40
+            for s in range(self.world.num_streets + 2)
+        ]
+        # tile of every corner, indexed by [avenue][street]
+        self._tile_rects = [
+            [pg.Rect(x, y, 40, 40) for y in self._st_px] for x in self._ave_px
+        ]
+        # line endpoints of every wall in the world
+        self._wall_segments = [
+            WALL_SEGMENT_MAP[wall.direction](
+                self._ave_px[wall.avenue], self._st_px[wall.street]
+            )
+            for wall in self.world.walls
+        ]
+
+    def redraw_all(self) -> None:
+        # background, bounding and walls
+        self.screen.blit(self.static_bg, (0, 0))
         # beepers
-        for location, count in self.world.beepers.items():
-            if count != 0:
-                corner_x = (location[0] - 1 + x_offset) * 40
-                corner_y = (self.world.num_streets - location[1] + y_offset) * 40
-                self.screen.blit(self.gem, (corner_x, corner_y))
+        self.screen.blits([
+            (self.gem, (self._ave_px[avenue], self._st_px[street]))
+            for avenue, street in self._beeper_corners
+        ], doreturn=False)
         # karel
-        corner_x = (self.karel.avenue - 1 + x_offset) * 40
-        corner_y = (self.world.num_streets - self.karel.street + y_offset) * 40
-        self.screen.blit(self.hero[self.karel.direction], (corner_x, corner_y))
+        self._hero_surface = self.hero[self.karel.direction]
+        self.screen.blit(
+            self._hero_surface,
+            (self._ave_px[self.karel.avenue], self._st_px[self.karel.street])
+        )
+        self._prev_karel_pos = (
+            self.karel.avenue, self.karel.street, self.karel.direction
+        )
         pg.display.update()
 
-    def load_student_code(self) -> None:
-        self.student_code = StudentCode(self.code_file)
-        self.student_code.inject_namespace(self.karel)
-        self.inject_decorator_namespace()
+    def redraw_corner(self, avenue: int, street: int) -> pg.Rect:
+        """Repaint a single corner onto the screen and return its tile."""
+        rect = self._tile_rects[avenue][street]
+        # background, bounding and walls
+        self.screen.blit(self.static_bg, rect, rect)
+        # beepers
+        if (avenue, street) in self._beeper_corners:
+            self.screen.blit(self.gem, rect)
+        # karel
+        if (avenue, street) == (self.karel.avenue, self.karel.street):
+            self.screen.blit(self._hero_surface, rect)
+        return rect
+
+    def update_beeper_corners(self) -> None:
+        """Rebuild the set of corners that currently hold at least one beeper."""
+        self._beeper_corners = {
+            location for location, count in self.world.beepers.items() if count != 0
+        }
 
-    def karel_action_decorator(
-        self, karel_fn: Callable[..., None]
-    ) -> Callable[..., None]:
-        def wrapper() -> None:
-            # execute Karel function
-            karel_fn()
-            # redraw canvas with updated state of the world
-            self.redraw_all()
-            # delay by specified amount
-            sleep(1 - self.speed / 100)
+    def _update_dirty_rects(self) -> None:
+        """Repaint the corners Karel left and entered since the last redraw."""
+        # only Karel's own corner can have gained or lost a beeper
+        corner = (self.karel.avenue, self.karel.street)
+        if self.world.beepers.get(corner, 0) != 0:
+            self._beeper_corners.add(corner)
+        else:
+            self._beeper_corners.discard(corner)
+        prev_avenue, prev_street, prev_direction = self._prev_karel_pos
+        # only look up a new sprite when Karel has actually turned
+        if self.karel.direction is not prev_direction:
+            self._hero_surface = self.hero[self.karel.direction]
+        dirty = [self.redraw_corner(self.karel.avenue, self.karel.street)]
+        if (prev_avenue, prev_street) != (self.karel.avenue, self.karel.street):
+            dirty.append(self.redraw_corner(prev_avenue, prev_street))
+        self._prev_karel_pos = (
+            self.karel.avenue, self.karel.street, self.karel.direction
+        )
+        pg.display.update(dirty)
 
-        return wrapper
+    @property
+    def _delay_ms(self) -> int:
+        return max(0, round((1 - self.speed / 100) * 1000))
 
-    def beeper_action_decorator(
-        self, karel_fn: Callable[..., None]
-    ) -> Callable[..., None]:
-        def wrapper() -> None:
-            # execute Karel function
-            karel_fn()
-            # redraw canvas with updated state of the world
-            self.redraw_all()
-            # delay by specified amount
-            sleep(1 - self.speed / 100)
+    def _delay_and_pump(self, ms: int) -> None:
+        """Wait between Karel actions while keeping the window responsive."""
+        deadline = pg.time.get_ticks() + ms
+        while True:
+            if pg.event.get(pg.QUIT):
+                exit()
+            # the window was uncovered, so present the current frame again
+            if pg.event.get((pg.VIDEOEXPOSE, pg.WINDOWEXPOSED)):
+                pg.display.update()
+            # discard everything else so the queue cannot fill up during a run
+            pg.event.clear()
+            remaining = deadline - pg.time.get_ticks()
+            if remaining <= 0:
+                break
+            pg.time.wait(min(remaining, 10))
+
+    def _check_deadline(self) -> None:
+        if self._deadline is not None and monotonic() > self._deadline:
+            raise KarelException(
+                self.karel.avenue,
+                self.karel.street,
+                self.karel.direction,
+                f"Time limit exceeded ({STUDENT_TIMEOUT} seconds). "
+                "Does your program have an infinite loop?",
+            )
 
-        return wrapper
+    def load_student_code(self) -> None:
+        self.student_code = StudentCode(self.code_file)
+        self.student_code.inject_namespace(self.karel)
+        self.inject_decorator_namespace()
 
-    def corner_action_decorator(
+    def _action_decorator(
         self, karel_fn: Callable[..., None]
     ) -> Callable[..., None]:
-        def wrapper(color: str) -> None:
+        def wrapper(*args: Any, **kwargs: Any) -> None:
             # execute Karel function
-            karel_fn(color)
-            # redraw canvas with updated state of the world
-            self.redraw_all()
-            # delay by specified amount
-            sleep(1 - self.speed / 100)
+            karel_fn(*args, **kwargs)
+            # redraw the corners touched by the action
+            self._update_dirty_rects()
+            # stop runaway programs
+            self._check_deadline()
+            # delay by specified amount, which does not count toward the limit
+            start = monotonic()
+            self._delay_and_pump(self._delay_ms)
+            if self._deadline is not None:
+                self._deadline += monotonic() - start
 
         return wrapper
 
@@ -291,35 +400,50 @@ class KarelApplication():
         file with specific commands relating to the Karel object that exists
         in the world.
         """
+        turn_left = self._action_decorator(self.karel.turn_left)
+        move = self._action_decorator(self.karel.move)
+        pick_beeper = self._action_decorator(self.karel.pick_beeper)
+        put_beeper = self._action_decorator(self.karel.put_beeper)
+        paint_corner = self._action_decorator(self.karel.paint_corner)
         for mod in self.student_code.mods:
-            mod.turn_left = self.karel_action_decorator(self.karel.turn_left)
-            mod.move = self.karel_action_decorator(self.karel.move)
-            mod.pick_beeper = self.beeper_action_decorator(self.karel.pick_beeper)
-            mod.put_beeper = self.beeper_action_decorator(self.karel.put_beeper)
-            mod.paint_corner = self.corner_action_decorator(self.karel.paint_corner)
+            mod.turn_left = turn_left
+            mod.move = move
+            mod.pick_beeper = pick_beeper
+            mod.put_beeper = put_beeper
+            mod.paint_corner = paint_corner
 
     def run_program(self) -> None:
         # Error checking for existence of main function completed in prior file
 
         # reimport code in case it changed
         self.load_student_code()
+        self._deadline = monotonic() + STUDENT_TIMEOUT
         try:
             self.student_code.main()
 
         except (KarelException, NameError):
+            # Imported here so tkinter is only loaded once a dialog is needed
+            from tkinter.messagebox import showwarning
+
             # Generate popup window to let the user know their program crashed
             pg.display.update()
             showwarning(
                 "Karel Error", "Karel Crashed!\nCheck the terminal for more details."
             )
+        finally:
+            self._deadline = None
 
     def reset_world(self) -> None:
         self.karel.reset_state()
         self.world.reset_world()
+        self.update_beeper_corners()
         self.redraw_all()
 
     def load_world(self) -> None:
-        default_worlds_path = Path(__file__).absolute().parent / "worlds"
+        # Imported here so tkinter is only loaded once a dialog is needed
+        from tkinter.filedialog import askopenfilename
+
+        default_worlds_path = _MODULE_DIR / "worlds"
         filename = askopenfilename(
             initialdir=default_worlds_path,
             title="Select Karel World",
@@ -330,4 +454,7 @@ class KarelApplication():
             return
         self.world.reload_world(filename=filename)
         self.karel.reset_state()
+        self.update_layout()
+        self.update_beeper_corners()
+        self.redraw_static()
         self.redraw_all()